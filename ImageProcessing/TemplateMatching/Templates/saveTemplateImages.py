@@ -1,27 +1,41 @@
 
 import tqdm # To get a progress bar.
 import os
+from concurrent.futures import ThreadPoolExecutor
 from ImageProcessing.TemplateMatching.Templates.templates import Templates
 
 
 import scipy
 if scipy.__version__ > "1.2.1":
     from imageio import imsave
+    # The templates are tiny, so a fast encode beats maximum compression.
+    _imsave_kwargs = dict(compress_level=1)
 else:
     from scipy.misc import imsave
+    _imsave_kwargs = dict()
+
+
+def _save_one(item):
+    filename, image = item
+    imsave(filename, image, **_imsave_kwargs)
 
 def saveAllTemplateImages():
-    currDir = os.getcwd()
     imageSaveDir = getImageDirectory()
-    os.chdir(imageSaveDir)
 
-    for ind, x in tqdm.tqdm(enumerate(Templates)):
-        if not os.path.exists(f"./im_template_{x}.png"):
-            imsave(f"./im_template_{x}.png", x.value[0])
+    # One directory scan instead of a stat per template. We write
+    # straight into imageSaveDir rather than changing the working
+    # directory for the whole process.
+    existing = {e.name for e in os.scandir(imageSaveDir or '.')
+                if e.name.startswith('im_template_')}
+    todo = [(os.path.join(imageSaveDir, f"im_template_{x}.png"), x.value[0])
+            for x in Templates if f"im_template_{x}.png" not in existing]
 
-    # Template images saved to the template directory.
+    # PNG encoding happens in zlib, which releases the GIL, so
+    # threads are enough to encode the images in parallel.
+    with ThreadPoolExecutor() as ex:
+        list(tqdm.tqdm(ex.map(_save_one, todo), total=len(todo)))
 
-    os.chdir(currDir)
+    # Template images saved to the template directory.
 
     return imageSaveDir
 
@@ -1,3 +1,12 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
 def test1():
     return True
 
@@ -14,9 +23,85 @@ def test4():
     return True
 
 
+def _write_dig_file(filename, n_samples=1 << 14, dt=2e-11):
+    "Write a small 8-bit .dig file of noise plus a linear chirp"
+    t = np.arange(n_samples) * dt
+    signal = np.sin(2 * np.pi * (2e9 + 1e18 * t) * t)
+    rng = np.random.default_rng(1)
+    raw = np.clip(128 + 60 * signal + rng.normal(0, 8, n_samples), 0, 255)
+    with open(filename, 'w') as f:
+        f.write("Spectrogram cache test\r\n")
+        f.write(" " * (512 - f.tell()))
+        f.write("\r\n".join(str(x) for x in (n_samples, 8, dt, 0.0,
+                                             1.0 / 128, -1.0)))
+        f.write(" " * (1024 - f.tell()))
+    with open(filename, 'ab') as f:
+        f.write(raw.astype(np.uint8).tobytes())
+
+
+def _same(a, b):
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    if isinstance(a, np.ndarray):
+        return np.array_equal(a, b)
+    return a == b
+
+
+def test_spectrogram_cache_round_trip():
+    import spectrogram
+    from ProcessingAlgorithms.preprocess.digfile import DigFile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        saved_dir = spectrogram.CACHE_DIR
+        spectrogram.CACHE_DIR = os.path.join(tmp, 'cache')
+        try:
+            filename = os.path.join(tmp, 'cache_test.dig')
+            _write_dig_file(filename)
+            df = DigFile(filename)
+            computed = spectrogram.Spectrogram(
+                df, points_per_spectrum=256, use_cache=True)
+            loaded = spectrogram.Spectrogram(
+                df, points_per_spectrum=256, use_cache=True)
+        finally:
+            spectrogram.CACHE_DIR = saved_dir
+
+        assert isinstance(loaded.intensity, np.memmap)
+        assert vars(computed).keys() == vars(loaded).keys()
+        for name, value in vars(computed).items():
+            assert _same(value, getattr(loaded, name)), name
+
+
+def test_spectrogram_cache_recovers_from_empty_file():
+    import spectrogram
+    from ProcessingAlgorithms.preprocess.digfile import DigFile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        saved_dir = spectrogram.CACHE_DIR
+        spectrogram.CACHE_DIR = os.path.join(tmp, 'cache')
+        try:
+            filename = os.path.join(tmp, 'cache_test.dig')
+            _write_dig_file(filename)
+            df = DigFile(filename)
+            computed = spectrogram.Spectrogram(
+                df, points_per_spectrum=256, use_cache=True)
+            # as left behind by an interrupted write
+            entry, = os.listdir(spectrogram.CACHE_DIR)
+            open(os.path.join(spectrogram.CACHE_DIR, entry,
+                              'intensity.npy'), 'w').close()
+            recomputed = spectrogram.Spectrogram(
+                df, points_per_spectrum=256, use_cache=True)
+        finally:
+            spectrogram.CACHE_DIR = saved_dir
+
+        assert not isinstance(recomputed.intensity, np.memmap)
+        assert np.array_equal(computed.intensity, recomputed.intensity)
+
+
 if __name__ == '__main__':
 
     test1()
     test2()
     test3()
     test4()
+    test_spectrogram_cache_round_trip()
+    test_spectrogram_cache_recovers_from_empty_file()
@@ -29,6 +29,11 @@ class PercentSlider(widgets.IntRangeSlider):
         )
         self._ymin = yrange[0]
         self._ymax = yrange[1]
+        self._update_factor()
+
+    def _update_factor(self):
+        "Cache the size of one percent of the range"
+        self._percent_factor = 0.01 * (self._ymax - self._ymin)
 
     @property
     def ymin(self):
@@ -37,6 +42,7 @@ class PercentSlider(widgets.IntRangeSlider):
     @ymin.setter
     def ymin(self, v):
         self._ymin = v
+        self._update_factor()
 
     @property
     def ymax(self):
@@ -45,14 +51,15 @@ class PercentSlider(widgets.IntRangeSlider):
     @ymax.setter
     def ymax(self, v):
         self._ymax = v
+        self._update_factor()
 
     @property
     def range(self):
-        dy = 0.01 * (self.ymax - self.ymin)
-        return [v * dy + self.ymin for v in self.value]
+        return [v * self._percent_factor + self._ymin for v in self.value]
 
     @range.setter
     def range(self, val):
         assert isinstance(val, (list, tuple)) and len(val) == 2
         self._ymin, self._ymax = val
+        self._update_factor()
 
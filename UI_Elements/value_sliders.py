@@ -40,10 +40,19 @@ class ValueSlider(widgets.FloatRangeSlider):
                 yrange[1] - yrange[0])) for x in initial_value],
             layout=widgets.Layout(width='400px'),
             **kwargs)
-        self.multiplier = multiplier
+        self.multiplier = multiplier  # also caches 1 / multiplier
         self._ymin = yrange[0] * multiplier
         self._ymax = yrange[1] * multiplier
 
+    @property
+    def multiplier(self):
+        return self._multiplier
+
+    @multiplier.setter
+    def multiplier(self, m):
+        self._multiplier = m
+        self._inv_multiplier = 1.0 / m
+
     @property
     def ymin(self):
         return self._ymin
@@ -62,7 +71,7 @@ class ValueSlider(widgets.FloatRangeSlider):
 
     @property
     def range(self):
-        return [v / self.multiplier for v in self.value]
+        return [v * self._inv_multiplier for v in self.value]
 
     @range.setter
     def range(self, val):  # fix?
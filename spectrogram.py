@@ -8,6 +8,9 @@
 """
 
 import os
+import shutil
+import tempfile
+import hashlib
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import signal
@@ -16,6 +19,33 @@ from scipy.signal import find_peaks
 from ProcessingAlgorithms.preprocess.digfile import DigFile
 from UI_Elements.plotter import COLORMAPS, DEFMAP
 
+# Where computed spectrogram intensities are cached between sessions,
+# and how many bytes the cache may hold before the least recently used
+# spectrograms are evicted
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'spectrogram')
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+def _trim_cache(directory, max_bytes, keep=None):
+    """
+    Remove the least recently used spectrogram folders from directory
+    until the ones that remain occupy no more than max_bytes. The
+    folder keep (the one just written) is never removed.
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_dir():
+            size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            entries.append((entry.stat().st_mtime, size, entry.path))
+    total = sum(x[1] for x in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
 
 class Spectrogram:
     """
@@ -49,6 +79,16 @@ class Spectrogram:
         the raw integral values are used.
     detrend: ("linear") the background subtraction method.
     complex_value: (False) do you want to maintain the phase information as well.
+    use_cache: (False) store the computed intensities under CACHE_DIR
+        and reload them (memory-mapped) the next time the same
+        spectrogram of the same (unmodified) digfile is requested.
+        Only applies to the default psd mode. The least recently used
+        entries are removed once the cache exceeds CACHE_MAX_BYTES.
+    column_major: (False) keep a column-major copy of the intensities,
+        built on first use, so that extracting single spectra
+        (columns) reads contiguous memory. This doubles the memory
+        used by the intensities and pulls a memory-mapped cache entry
+        fully into RAM, so only turn it on for modest spectrograms.
     **Computed fields**
 
     time:      array of times at which the spectra are computed
@@ -108,6 +148,14 @@ class Spectrogram:
         self.use_voltage = convert_to_voltage
         self.detrend = detrend
         self.nfft = kwargs.get('nfft')  # handles zero padding
+        self.use_cache = kwargs.pop('use_cache', False)
+        self.column_major = kwargs.pop('column_major', False)
+        self._intensity_F = None
+
+        # The window array depends only on window_function and
+        # points_per_spectrum, so keep it across recomputations
+        self._window = None
+        self._window_key = None
 
         # the following will be set by _calculate
         self.time = None
@@ -131,7 +179,13 @@ class Spectrogram:
         Compute a spectrogram. This needs work! There need to be
         lots more options that we either want to supply with
         default values or decode kwargs. But it should be a start.
+        If we have cached this spectrogram on disk, load it instead.
         """
+        self._intensity_F = None  # any column-major copy is now stale
+        cache = self._cache_location(ending, **kwargs)
+        if cache and self._load_cache(cache):
+            return
+
         if self.use_voltage:
             vals = self.data.values(self.t_start, ending)
         else:
@@ -166,8 +220,7 @@ class Spectrogram:
             freqs, times, spec = signal.spectrogram(
                 vals,
                 1.0 / self.data.dt,  # the sample frequency
-                window=self.window_function if self.window_function else (
-                    'tukey', 0.25),
+                window=self.window(),
                 nperseg=self.points_per_spectrum,
                 noverlap=int(self.overlap * self.points_per_spectrum),
                 detrend=self.detrend,  # could be constant,
@@ -203,7 +256,15 @@ class Spectrogram:
             # Convert to a logarithmic representation and use floor to attempt
             # to suppress some noise.
         self.histogram_levels = self.histo_levels(self.intensity)
+        self._set_axes(freqs, times)
+        if cache:
+            self._save_cache(cache)
 
+    def _set_axes(self, freqs, times):
+        """
+        Install the frequency and time axes of a freshly computed
+        (or loaded) intensity array and derive the dependent values.
+        """
         # the first index is frequency, the second time
         self.frequency = freqs
         self.time = times
@@ -218,6 +279,25 @@ class Spectrogram:
         # self.estimateStartTime()
 
 
+    def window(self):
+        """
+        Return the window array applied to each segment, building it
+        only when window_function or points_per_spectrum has changed.
+        """
+        spec = self.window_function
+        if isinstance(spec, np.ndarray):
+            return spec
+        if not spec:
+            spec = ('tukey', 0.25)
+        if not isinstance(spec, (str, tuple)):
+            # an explicit sequence of window coefficients
+            return np.asarray(spec)
+        key = (spec, self.points_per_spectrum)
+        if key != self._window_key:
+            self._window = signal.get_window(spec, self.points_per_spectrum)
+            self._window_key = key
+        return self._window
+
     def transform(self, vals):
         """
         Perform any modification to values dictated by the value of self.form
@@ -290,6 +370,28 @@ class Spectrogram:
             return 0
         return min(p, -1 + len(self.velocity))
 
+    def slice_indices(self, time_range, velocity_range):
+        """
+        Return the inclusive index bounds (time0, time1, vel0, vel1)
+        of the portion of the spectrogram selected by time_range and
+        velocity_range, as used by slice. Either range may be None to
+        select everything along that axis.
+        """
+        if time_range == None:
+            time0, time1 = 0, len(self.time) - 1
+        else:
+            time0, time1 = [self._time_to_index(t) for t in time_range]
+        if velocity_range == None:
+            vel0, vel1 = 0, len(self.velocity) - 1
+        else:
+            vel0, vel1 = [self._velocity_to_index(v) for v in velocity_range]
+        if time0 > time1:
+            time0, time1 = time1, time0  # Then we will just swap them.
+        if vel0 > vel1:
+            # Then we will just swap them so that we can index normally.
+            vel0, vel1 = vel1, vel0
+        return time0, time1, vel0, vel1
+
     def slice(self, time_range, velocity_range, complexData: bool = False, phaseData: bool = False):
         """
         Input:
@@ -309,19 +411,7 @@ class Spectrogram:
             original_spec: the output of the rolling FFT that we used. Depends on
                 the value of self.computeMode
         """
-        if time_range == None:
-            time0, time1 = 0, len(self.time) - 1
-        else:
-            time0, time1 = [self._time_to_index(t) for t in time_range]
-        if velocity_range == None:
-            vel0, vel1 = 0, len(self.velocity) - 1
-        else:
-            vel0, vel1 = [self._velocity_to_index(v) for v in velocity_range]
-        if time0 > time1:
-            time0, time1 = time1, time0  # Then we will just swap them.
-        if vel0 > vel1:
-            # Then we will just swap them so that we can index normally.
-            vel0, vel1 = vel1, vel0
+        time0, time1, vel0, vel1 = self.slice_indices(time_range, velocity_range)
         tvals = self.time[time0:time1 + 1]
         vvals = self.velocity[vel0:vel1 + 1]
         ivals = self.intensity[vel0:vel1 + 1, time0:time1 + 1]
@@ -440,6 +530,86 @@ class Spectrogram:
 
     # Routines to archive the computed spectrogram and reload from disk
 
+    _ladder = ('tens', 'ones', 'tenths')
+
+    def _cache_location(self, ending, **kwargs):
+        """
+        Return the cache folder for the spectrogram that _compute is
+        about to produce, or None if this spectrogram should not be
+        cached. The name is a hash of everything that determines the
+        intensities, including the modification time of the digfile.
+        """
+        if not self.use_cache or kwargs.get('mode', 'none') not in ('none', 'psd'):
+            return None
+        try:
+            mtime = os.path.getmtime(self.data.path)
+        except OSError:
+            return None
+        key = hashlib.blake2b(":".join(str(x) for x in (
+            self.data.path, mtime, self.t_start, ending,
+            self.points_per_spectrum, self.overlap,
+            self.form, self.use_voltage, self.detrend, self.nfft,
+            kwargs.get('scaling', 'spectrum'))).encode())
+        # str() abbreviates long arrays, so hash the window's values
+        window = self.window()
+        if isinstance(window, np.ndarray):
+            key.update(f"{window.dtype}{window.shape}".encode())
+            key.update(window.tobytes())
+        else:
+            key.update(str(window).encode())
+        return os.path.join(CACHE_DIR, key.hexdigest())
+
+    def _load_cache(self, location):
+        """
+        Try to restore the spectrogram from the cache folder at location.
+        The intensity array is memory-mapped read-only, so slicing it
+        does not copy. Return True on success.
+        """
+        try:
+            def load(name, **kw):
+                return np.load(os.path.join(location, name + '.npy'),
+                               allow_pickle=False, **kw)
+            self.intensity = load('intensity', mmap_mode='r')
+            self.psd = load('psd', mmap_mode='r')
+            levels = load('histogram_levels')
+            freqs, times = load('frequency'), load('time')
+            os.utime(location)  # mark as recently used
+        except (OSError, ValueError, EOFError):
+            return False
+        self.histogram_levels = dict(zip(self._ladder, levels))
+        self.availableData = ['intensity']
+        self._set_axes(freqs, times)
+        return True
+
+    def _save_cache(self, location):
+        """
+        Write the computed spectrogram to the cache folder at location,
+        then trim the cache. Each file is written to a temporary name
+        and then moved into place, so an interrupted write never leaves
+        a truncated file behind. Failing to write the cache is not an
+        error.
+        """
+        try:
+            os.makedirs(location, exist_ok=True)
+            for name, vals in (
+                    ('intensity', self.intensity),
+                    ('psd', self.psd),
+                    ('histogram_levels',
+                     np.array([self.histogram_levels[x] for x in self._ladder])),
+                    ('frequency', self.frequency),
+                    ('time', self.time)):
+                fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=location)
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        np.save(f, vals, allow_pickle=False)
+                    os.replace(tmp, os.path.join(location, name + '.npy'))
+                except BaseException:
+                    os.remove(tmp)
+                    raise
+            _trim_cache(os.path.dirname(location), CACHE_MAX_BYTES, location)
+        except OSError:
+            pass
+
     def _location(self, location, create=False):
         """
 
@@ -500,6 +670,19 @@ class Spectrogram:
         """The minimum intensity value"""
         return self.intensity.min()
 
+    @property
+    def intensity_columns(self):
+        """
+        The intensity array in column-major (Fortran) order, so that a
+        slice intensity_columns[v0:v1, t] is contiguous. If column_major
+        is False, this is just the intensity array.
+        """
+        if not self.column_major:
+            return self.intensity
+        if self._intensity_F is None:
+            self._intensity_F = np.asfortranarray(self.intensity)
+        return self._intensity_F
+
     @property
     def dv(self):
         "The velocity step size"
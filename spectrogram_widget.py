@@ -10,6 +10,8 @@
 """
 
 import os
+import functools
+from collections import OrderedDict
 # import cv2
 import numpy as np
 import matplotlib.pyplot as plt
@@ -17,6 +19,8 @@ import matplotlib.pyplot as plt
 import ipywidgets as widgets
 
 from matplotlib import widgets as mwidgets
+from matplotlib.cm import ScalarMappable
+from matplotlib.collections import LineCollection
 from IPython.display import display
 from spectrogram import Spectrogram
 
@@ -36,6 +40,45 @@ from UI_Elements.value_sliders import ValueSlider
 # Note that this class is not actually used yet. 02/07/20
 # from UI_Elements.percent_slider import PercentSlider
 
+# If CuPy and a CUDA device are available, slice, clip, and color the
+# spectrogram on the GPU
+try:
+    import cupy as cp
+    if cp.cuda.runtime.getDeviceCount() < 1:
+        raise RuntimeError("no CUDA device")
+except Exception:
+    # no CuPy, or CuPy without a driver or device to run on
+    cp = None
+
+# Otherwise, if Numba is available, clip, normalize, and color the
+# spectrogram in a single pass on the CPU
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+    # Every fastmath flag except nnan and ninf, since the spectrogram
+    # can hold -inf (log of zero power) and the threshold may be -inf
+    @njit(parallel=True, cache=True,
+          fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'})
+    def _fuse_to_rgba(x, thr, lo, hi, lut, out):
+        """
+        Fill out[i, j] with the packed RGBA entry of lut (256 uint32
+        values) for max(x[i, j], thr) scaled linearly from [lo, hi].
+        NaN maps to the bottom of the table.
+        """
+        scale = 255.0 / (hi - lo) if hi != lo else 1.0
+        for i in prange(x.shape[0]):
+            for j in range(x.shape[1]):
+                f = (max(x[i, j], thr) - lo) * scale
+                if not f >= 0.0:
+                    # also catches NaN, which fails every comparison
+                    f = 0.0
+                elif f > 255.0:
+                    f = 255.0
+                out[i, j] = lut[int(f)]
+
 class SpectrogramWidget:
     """
     A Jupyter notebook widget to represent a spectrogram, along with
@@ -62,7 +105,9 @@ class SpectrogramWidget:
     - digfile: either a string or DigFile
     - kwargs: optional keyword arguments. These are passed to
       the Spectrogram constructor and to the routine that
-      creates the control widgets.
+      creates the control widgets. Pass use_cache=True to keep the
+      computed spectrogram on disk, so that reopening the same
+      digfile with the same settings loads it instead of recomputing.
 
     **Data members**
 
@@ -75,6 +120,9 @@ class SpectrogramWidget:
     - axSpectrogram:
     - image:
     - colorbar:
+    - scalar_map: the ScalarMappable holding the norm and colormap shown
+      in the colorbar; this is the image itself unless we are coloring
+      the image on the GPU
     - individual_controls: dictionary of widgets
     - controls:
     """
@@ -138,11 +186,33 @@ class SpectrogramWidget:
 
             self.spectrogram.overlap = 0.875
 
+        # Memoize the most recent slices of the spectrogram, so that
+        # revisiting a time/velocity window does not re-slice the array
+        self._cached_slice = functools.lru_cache(maxsize=8)(self._slice)
+        self._last_slice = None  # (trange, vrange, intensities) last displayed
+        self._intensity_stats = None  # (imin, imax, histogram_levels)
+        self._thumb_cache = OrderedDict()  # DigFile thumbnails by t_range
+        self._cmap_cache = {}  # computed colormaps by (spectrogram, name)
+
         self.fig, axes = plt.subplots(
             nrows=1, ncols=2, sharey=True,
             squeeze=True, gridspec_kw=self._gspec)
         self.axSpectrogram, self.axSpectrum = axes
 
+        # Where the canvas supports it, the spectra, their markers, and
+        # the follower traces are animated artists, left out of full
+        # redraws and blitted on top of a saved copy of the rest of the
+        # figure. Other canvases (e.g., webagg and ipympl under
+        # matplotlib 3.1) ignore blit, so there they are drawn as usual.
+        self._bg = None
+
+        # All peak follower traces are drawn as dots in one collection
+        self.follower_points = self.axSpectrogram.scatter(
+            [], [], s=4, c='r', alpha=0.4, linewidths=0,
+            animated=self.blitting)
+        self.fig.canvas.mpl_connect(
+            'draw_event', lambda x: self._on_draw(x))
+
         self.subfig = None
         self.axTrack = None
         self.axSpare = None
@@ -160,6 +230,14 @@ class SpectrogramWidget:
 
         self.image = None     # we will set in update_spectrogram
         self.colorbar = None  # we will set this on updating, based on the
+        self.scalar_map = None
+        self._gpu = None        # the intensity array resident on the GPU
+        self._cmap = None       # colormap currently applied
+        self._lut = None        # 256-entry RGBA lookup table
+        self._lut_cmap = None   # colormap self._lut was built from
+        self._quiet = False     # suppress recoloring from slider callbacks
+        self._displayed = None  # slice currently shown, if we color it
+        self._rgba_buf = None   # output buffer for _fuse_to_rgba
 
         self.peak_followers = []  # will hold any PeakFollowers
         self.spectra = []         # will hold spectra displayed at right
@@ -193,6 +271,30 @@ class SpectrogramWidget:
         else:
             return self._static['intensity']
 
+    @property
+    def gpu(self):
+        "True if we slice and color the displayed spectrogram on the GPU"
+        return cp is not None and self.dig
+
+    @property
+    def fused(self):
+        "True if we color the displayed spectrogram with the Numba kernel"
+        return njit is not None and not self.gpu
+
+    @property
+    def intensity_stats(self):
+        """
+        Return (imin, imax, histogram_levels) for the intensity array.
+        These are computed once and then reused until overhaul
+        recomputes the spectrogram. The histogram_levels are None if
+        we are not associated with a dig file.
+        """
+        if self._intensity_stats is None:
+            a = self.intensity.ravel()
+            levels = self.spectrogram.histogram_levels if self.dig else None
+            self._intensity_stats = (a.min(), a.max(), levels)
+        return self._intensity_stats
+
     def make_controls(self, **kwargs):
         """
         Create the controls for this widget and store them in self.controls.
@@ -278,9 +380,8 @@ class SpectrogramWidget:
 
         # Color range ###########################################
 
-        imax = self.intensity.max()
+        _, imax, hl = self.intensity_stats
         if self.dig:
-            hl = self.spectrogram.histogram_levels
             imin = hl['tens'][3]
             # Let's figure out the range likely to produce a clear
             # image. Put the 50% point at the bottom end and the 95%
@@ -409,6 +510,27 @@ class SpectrogramWidget:
     def do_update(self, what):
         self.update_spectrogram()
 
+    def _slice(self, t0, t1, v0, v1, pps, overlap):
+        """
+        Extract the (times, velocities, intensities) of the
+        spectrogram in the given window. The points_per_spectrum and
+        overlap arguments are unused here, but they form part of the
+        key under which self._cached_slice memoizes the result.
+        """
+        return self.spectrogram.slice((t0, t1), (v0, v1))
+
+    def slice(self, trange, vrange):
+        """
+        Return the (times, velocities, intensities) of the spectrogram
+        in the time range trange and velocity range vrange, reusing
+        a recent slice if we have one.
+        """
+        sg = self.spectrogram
+        return self._cached_slice(
+            round(trange[0], 9), round(trange[1], 9),
+            round(vrange[0], 3), round(vrange[1], 3),
+            sg.points_per_spectrum, sg.overlap)
+
     def show_raw_signal(self, box):
         """
         Display or remove the thumbnail of the time series data
@@ -416,8 +538,7 @@ class SpectrogramWidget:
         """
         if box.new:
             # display the thumbnail
-            t_range = self.range('t_range')
-            thumb = self.digfile.thumbnail(*t_range)
+            thumb = self.thumbnail(self.range('t_range'))
             # we have to superpose the thumbnail on the
             # existing velocity axis, so we need to rescale
             # the vertical.
@@ -440,6 +561,22 @@ class SpectrogramWidget:
             except:
                 pass
 
+    def thumbnail(self, t_range, cache_size=4):
+        """
+        Return the DigFile thumbnail over t_range, keeping the
+        cache_size most recently used thumbnails so that toggling
+        the raw signal does not rescan the digfile.
+        """
+        key = (round(t_range[0], 9), round(t_range[1], 9))
+        cache = self._thumb_cache
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            cache[key] = self.digfile.thumbnail(*t_range)
+            if len(cache) > cache_size:
+                cache.popitem(last=False)
+        return cache[key]
+
     def overhaul(self, **kwargs):
         """
         A parameter affecting the base spectrogram has been changed, so
@@ -450,20 +587,19 @@ class SpectrogramWidget:
                 self.spectrogram_fresh = False
             else:
                 self.spectrogram.set(**kwargs)
+            self._cached_slice.cache_clear()
+            self._intensity_stats = None
+            self._cmap_cache.clear()
+            self._gpu = None
         self.update_spectrogram()
 
     def update_spectrogram(self):
         """
         Recompute and display everything
         """
-
-        intense = self.spectrogram.intensity if self.dig else self._static['intensity']
-
         # Having recomputed the spectrum, we need to set the yrange
-
         # of the color map slider
-        cmin = intense.min()
-        cmax = intense.max()
+        cmin, cmax, _ = self.intensity_stats
         self.controls['intensity_range'].range = (cmin, cmax)
         self.display_spectrogram()
 
@@ -476,80 +612,202 @@ class SpectrogramWidget:
 
         if self.dig:
             # extract the requisite portions
-            times, velocities, intensities = self.spectrogram.slice(
-                trange, vrange)
+            times, velocities, intensities = self.slice(trange, vrange)
         else:
             d = self._static
             times, velocities, intensities = d['time'], d['velocity'], d['intensity']
-
-        # if we have already displayed an image, remove it
-        if self.colorbar:
-            self.colorbar.remove()
-            self.colorbar = None
-        if self.image:
-            self.image.remove()
-        self.image = None
-
-        if self.threshold:
-            intensities[intensities < self.threshold] = self.threshold
-
-        self.image = self.axSpectrogram.pcolormesh(
-            times * 1e6, velocities, intensities)
-
-        self.colorbar = self.fig.colorbar(self.image, ax=self.axSpectrogram,
-                                          fraction=0.08)
+        self._last_slice = (trange, vrange, intensities)
+        # Settle the colormap (which may move the color range) before
+        # coloring, so the image is colored exactly once
+        self._cmap = self._select_cmap()
+
+        if self.gpu:
+            # Keep the full intensity array on the GPU, and slice, clip,
+            # normalize, and look up colors there. Only the final RGBA
+            # image comes back to the host.
+            if self._gpu is None:
+                self._gpu = cp.asarray(self.spectrogram.intensity)
+            t0, t1, v0, v1 = self.spectrogram.slice_indices(trange, vrange)
+            block = self._gpu[v0:v1 + 1, t0:t1 + 1]
+            if self.threshold is not None:
+                block = cp.maximum(block, self.threshold)
+            self._displayed = block
+            intensities = self._colorize()
+        elif self.fused:
+            # The kernel applies the threshold itself, so it can read
+            # the slice straight from the spectrogram
+            self._displayed = intensities
+            intensities = self._colorize()
+        else:
+            # The screen only resolves 8 bits per channel, so hand
+            # matplotlib a float32 copy, which halves the bytes it has to
+            # resample. The full-precision slice is left untouched.
+            if self.threshold is not None:
+                # Clip in a single ufunc pass. The slice is a (cached) view
+                # of the spectrogram, so write the result to a fresh
+                # contiguous array rather than clobbering the source.
+                intensities = np.maximum(intensities, self.threshold,
+                                         dtype=np.float32)
+            else:
+                intensities = np.asarray(intensities, dtype=np.float32)
+
+        # The spectrogram lies on a regular grid, so we can display it
+        # as a single image rather than a mesh of one polygon per cell.
+        # Build the image and colorbar once; afterwards just swap in
+        # the new data and extent. Each pixel is centered on its sample,
+        # so pad the extent by half a step on every side. Take the steps
+        # from the full axes, since a slice may be a single row or column.
+        if self.dig:
+            all_t, all_v = self.spectrogram.time, self.spectrogram.velocity
+        else:
+            all_t, all_v = self._static['time'], self._static['velocity']
+        dt = 0.5 * (all_t[1] - all_t[0])
+        dv = 0.5 * (all_v[1] - all_v[0])
+        extent = ((times[0] - dt) * 1e6, (times[-1] + dt) * 1e6,
+                  velocities[0] - dv, velocities[-1] + dv)
+        if self.image is None:
+            cmap = self._cmap
+            self.image = self.axSpectrogram.imshow(
+                intensities, extent=extent, origin='lower',
+                aspect='auto', interpolation='nearest', cmap=cmap)
+            if self._displayed is not None:
+                # The image is already RGBA, so the colorbar needs its
+                # own mappable to carry the norm and colormap
+                self.scalar_map = ScalarMappable(cmap=cmap)
+                self.scalar_map.set_array([])
+                self.scalar_map.set_clim(self.range('intensity_range'))
+            else:
+                self.scalar_map = self.image
+            self.colorbar = self.fig.colorbar(self.scalar_map, ax=self.axSpectrogram,
+                                              fraction=0.08)
+        else:
+            self.image.set_data(intensities)
+            self.image.set_extent(extent)
+            self.colorbar.update_normal(self.scalar_map)
 
         self.axSpectrogram.set_title(self.title, usetex=False)
         self.axSpectrogram.set_xlabel('Time ($\mu$s)')
         self.axSpectrogram.set_xlim(* (np.array(trange) * 1e6))
         self.axSpectrogram.set_ylabel('Velocity (m/s)')
         self.update_velocity_range()
-        self.update_color_range()
-        self.update_cmap()
+        # The image already reflects the color settings; just bring the
+        # mappable (and hence the colorbar) in line
+        self.scalar_map.set_cmap(self._cmap)
+        self.scalar_map.set_clim(self.range('intensity_range'))
+        self.fig.canvas.draw_idle()
 
     def update_threshold(self, x):
-        sg = self.spectrogram
+        hl = self.intensity_stats[2]
         if int(x) == 0:
             self.threshold = None
         else:
             if x < 90:
-                threshold = sg.histogram_levels['tens'][x // 10]
+                threshold = hl['tens'][int(x // 10)]
             elif x < 99:
-                threshold = sg.histogram_levels['ones'][int(x - 90)]
+                threshold = hl['ones'][int(x - 90)]
             else:
-                threshold = sg.histogram_levels['tenths'][int(10 * (x - 99))]
-            self.threshold = self.spectrogram.transform(threshold)
+                threshold = hl['tenths'][int(10 * (x - 99))]
+            # The histogram levels are taken from the (already transformed)
+            # intensities, so they serve as the threshold as they are.
+            # A non-finite level would blank or garble the image.
+            threshold = float(threshold)
+            self.threshold = threshold if np.isfinite(threshold) else None
         self.display_spectrogram()
 
     def update_cmap(self):
         """
         Update the color map used to display the spectrogram
         """
+        cmap = self._select_cmap()
+        # Recoloring below also picks up any change _select_cmap made to
+        # the color range
+        self.scalar_map.set_clim(self.range('intensity_range'))
+        if cmap is not self._cmap:
+            self._cmap = cmap
+            self.scalar_map.set_cmap(cmap)
+        self._recolor()
+        self.fig.canvas.draw_idle()
+
+    def _select_cmap(self):
+        """
+        Return the colormap chosen in the dropdown. For the Computed map,
+        also move the color range to its centroids, without the slider
+        callback recoloring the image.
+        """
         mapname = self.controls['color_map'].value
         if mapname == 'Computed':
-            from UI_Elements.generate_color_map import make_spectrogram_color_map
-            mapinfo = make_spectrogram_color_map(
-                self.spectrogram, 4, mapname)
+            # Clustering the intensities is expensive, so only do it
+            # once per spectrogram
+            key = (id(self.spectrogram), mapname)
+            mapinfo = self._cmap_cache.get(key)
+            if mapinfo is None:
+                from UI_Elements.generate_color_map import make_spectrogram_color_map
+                mapinfo = make_spectrogram_color_map(
+                    self.spectrogram, 4, mapname)
+                self._cmap_cache[key] = mapinfo
             maprange = (mapinfo['centroids'][1], mapinfo['centroids'][-2])
-            self.controls['intensity_range'].value = maprange
-        self.image.set_cmap(COLORMAPS[mapname])
+            self._quiet = True
+            try:
+                self.controls['intensity_range'].value = maprange
+            finally:
+                self._quiet = False
+            return mapinfo['cmap']
+        return COLORMAPS[mapname]
 
     def update_velocity_range(self, info=None):
         """
         Update the displayed velocity range using values obtained
         from the 'velocity_range' slider.
         """
-        if info:
-            old_vmin, old_vmax = info['old']
-            vmin, vmax = info['new']
+        vmin, vmax = self.range('velocity_range')
+        if info and self._last_slice:
+            # Only re-slice if the new range extends beyond the
+            # velocities currently held in the image
+            old_vmin, old_vmax = self._last_slice[1]
             if vmax > old_vmax or vmin < old_vmin:
                 return self.update_spectrogram()
-        vmin, vmax = self.range('velocity_range')
         self.axSpectrogram.set_ylim(vmin, vmax)
         self.axSpectrum.set_ylim(vmin, vmax)
 
     def update_color_range(self):
-        self.image.set_clim(self.range('intensity_range'))
+        if self._quiet:
+            return
+        self.scalar_map.set_clim(self.range('intensity_range'))
+        self._recolor()
+        self.fig.canvas.draw_idle()
+
+    def _colorize(self):
+        """
+        Map the slice in self._displayed through the color range and
+        colormap, returning the RGBA image as a host array. This runs on
+        the GPU if we have CuPy, and otherwise uses _fuse_to_rgba.
+        """
+        if self._lut is None or self._lut_cmap is not self._cmap:
+            self._lut_cmap = self._cmap
+            lut = self._cmap(np.linspace(0.0, 1.0, 256), bytes=True)
+            if self.gpu:
+                self._lut = cp.asarray(lut)
+            else:
+                # pack each RGBA entry into one uint32
+                self._lut = np.ascontiguousarray(lut).view(np.uint32).ravel()
+        lo, hi = self.range('intensity_range')
+        if not self.gpu:
+            x = self._displayed
+            if self._rgba_buf is None or self._rgba_buf.shape != x.shape:
+                self._rgba_buf = np.empty(x.shape, dtype=np.uint32)
+            thr = -np.inf if self.threshold is None else self.threshold
+            _fuse_to_rgba(x, thr, lo, hi, self._lut, self._rgba_buf)
+            return self._rgba_buf.view(np.uint8).reshape(x.shape + (4,))
+        scaled = (self._displayed - lo) * (255.0 / ((hi - lo) or 1.0))
+        # casting NaN to uint8 is undefined, so send it to the bottom
+        cp.nan_to_num(scaled, copy=False, nan=0.0)
+        cp.clip(scaled, 0, 255, out=scaled)
+        return cp.asnumpy(self._lut[scaled.astype(cp.uint8)])
+
+    def _recolor(self):
+        "If we color the image ourselves, redo it with the current settings"
+        if self._displayed is not None:
+            self.image.set_data(self._colorize())
 
     def handle_click(self, event):
         try:
@@ -605,6 +863,38 @@ class SpectrogramWidget:
         if char in ('a', 'A') and self.roi:
             self.analyze_roi()
 
+    @property
+    def blitting(self):
+        "Can we blit the animated artists onto this figure's canvas?"
+        return getattr(self.fig.canvas, 'supports_blit', False)
+
+    def _on_draw(self, event):
+        "After a full redraw, save the background and restore the animated artists"
+        if not self.blitting:
+            return
+        self._bg = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for spec in self.spectra:
+            self.axSpectrum.draw_artist(spec['line'])
+            self.axSpectrogram.draw_artist(spec['marker'])
+        self.axSpectrogram.draw_artist(self.follower_points)
+
+    def _blit(self):
+        """
+        Redraw just the animated artists over the saved background,
+        falling back to a full redraw if we can't blit or don't have
+        a background yet.
+        """
+        if not self.blitting or self._bg is None:
+            self.fig.canvas.draw_idle()
+            return
+        self.fig.canvas.restore_region(self._bg)
+        self._draw_animated()
+        self.fig.canvas.blit(self.fig.bbox)
+        self.fig.canvas.flush_events()
+
     def clear_spectra(self):
         """Remove all spectra from axSpectrum and the corresponding
         markers from axSpectrogram
@@ -613,16 +903,13 @@ class SpectrogramWidget:
             self.axSpectrogram.lines.remove(x['marker'])
             self.axSpectrum.lines.remove(x['line'])
         self.spectra = []
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+        self._blit()
 
     def clear_followers(self):
         """Remove all followers"""
-        for x in self.peak_followers:
-            self.axSpectrogram.lines.remove(x.line)
         self.peak_followers = []
-        self.fig.canvas.draw()
-        self.fig.canvas.flush_events()
+        self.follower_points.set_offsets(np.empty((0, 2)))
+        self._blit()
 
     def follow(self, t, v, action):
         """Attempt to follow the path starting with the clicked
@@ -637,8 +924,10 @@ class SpectrogramWidget:
             self.peak_followers.append(follower)
             follower.run()
             tsec, v = follower.v_of_t
-            follower.line = self.axSpectrogram.plot(
-                tsec * 1e6, v, 'r.', alpha=0.4, markersize=2)[0]
+            follower.points = np.column_stack([tsec * 1e6, v])
+            self.follower_points.set_offsets(
+                np.concatenate([x.points for x in self.peak_followers]))
+            self._blit()
         # print("Create a figure and axes, then call self.gauss.show_fit(axes)")
 
     def gauss_out(self, n: int):
@@ -651,16 +940,31 @@ class SpectrogramWidget:
         WRITEOUT, fnum = False, 0
         pf = self.peak_followers[n]
         times, centers, widths, amps = [], [], [], []
-        vind = pf.frame['vi_span'].to_numpy()
+        vind = np.array(list(pf.frame['vi_span']), dtype=int)
         tind = pf.frame['t_index'].to_numpy()
         sp = self.spectrogram
+
+        # Pull every time's span in one gather and convert them to power
+        # in a single call. Row j holds the span of time tind[j], padded
+        # out to the widest span; these padding values are never used.
+        spans = vind[:, 1] - vind[:, 0]
+        rows = np.minimum(vind[:, :1] + np.arange(spans.max()),
+                          len(sp.velocity) - 1)
+        block = sp.power(sp.intensity_columns[rows, tind[:, None]])
+        width, background = self._moments(block, sp.velocity[rows], spans)
         for j in range(len(tind)):
             t = sp.time[tind[j]] * 1e6
             vfrom, vto = vind[j]
-            powers = sp.power(sp.intensity[vfrom:vto, tind[j]])
+            powers = block[j, :spans[j]]
             speeds = sp.velocity[vfrom:vto]
 
-            gus = Gaussian(speeds, powers)
+            # Seed the width and background from the moments. The moment
+            # center is pulled toward the middle of the span by noise, so
+            # Gaussian keeps its own seed at the peak for the center.
+            guess = dict(background=background[j])
+            if width[j] > 0:
+                guess['width'] = width[j]
+            gus = Gaussian(speeds, powers, **guess)
             if gus.valid:
                 times.append(t)
                 centers.append(gus.center)
@@ -703,6 +1007,26 @@ class SpectrogramWidget:
             amplitude=np.array(amps)
         )
 
+    @staticmethod
+    def _moments(block, speeds, spans):
+        """
+        Estimate gaussian widths and backgrounds for every row of block
+        at once. Row j holds powers at the speeds in row j of speeds;
+        only its first spans[j] columns belong to that row. The background
+        is the smallest power in the span, and the width is the second
+        moment of the power above it.
+        Returns arrays (width, background).
+        """
+        k = np.arange(block.shape[1])
+        inside = k < spans[:, None]
+        background = np.where(inside, block, np.inf).min(axis=1)
+        weights = np.where(inside, block - background[:, None], 0.0)
+        wsum = weights.sum(axis=1)
+        wsum[wsum == 0] = 1.0
+        center = (weights * speeds).sum(axis=1) / wsum
+        var = (weights * (speeds - center[:, None]) ** 2).sum(axis=1) / wsum
+        return np.sqrt(var), background
+
     def gaussian_explorer(self, follower_pt: int):
         """
         Show center velocity, width, and amplitude for gaussian
@@ -802,7 +1126,7 @@ class SpectrogramWidget:
         spans = []
         vvec = self.spectrogram.velocity  # shortcut to velocity vector
         tvec = self.spectrogram.time
-        ivec = self.spectrogram.intensity
+        ivec = self.spectrogram.intensity_columns  # columns are contiguous
 
         # pre-extract a bunch of one-dimensional curves
         # and be sure to convert to power
@@ -820,14 +1144,12 @@ class SpectrogramWidget:
         # the maxpower
         offset = 0.025 * maxpower
 
-        for n in reversed(list(range(len(spans)))):
-            span = spans[n]
-            self.axTrack.plot(
-                span['power'] + n * offset,
-                span['v'],
-                'b-',
-                alpha=0.33
-            )
+        waterfall = LineCollection(
+            [np.column_stack([spans[n]['power'] + n * offset, spans[n]['v']])
+             for n in reversed(list(range(len(spans))))],
+            colors='b', alpha=0.33)
+        self.axTrack.add_collection(waterfall)
+        self.axTrack.autoscale_view()
         self.axTrack.set_ylabel('$v$')
 
     def squash_vertical(self):
@@ -858,10 +1180,7 @@ class SpectrogramWidget:
                 self.axSpectrum.lines.remove(b['line'])
             self.baselines = []  # remove them
         else:
-            edges = (
-                self.spectrogram.intensity.min(),
-                self.spectrogram.intensity.max()
-            )
+            edges = self.intensity_stats[:2]
             for v in blines:
                 bline = self.axSpectrum.plot(
                     [edges[0], edges[1]],
@@ -915,16 +1234,23 @@ class SpectrogramWidget:
                 # compute the level of the 90th percentile
                 spec = dict(spectrum=the_spectrum)
                 vals = the_spectrum.db
-                ordering = np.argsort(vals)
+                # We only need the top decile (plus any baselines we
+                # skip over), so partition rather than sort everything.
+                k = min(len(vals),
+                        int(0.1 * len(vals)) + 2 + len(self.baselines))
+                top = np.argpartition(vals, -k)[-k:]
+                ordering = top[np.argsort(vals[top])]
                 if self.baselines:
-                    blines = [x['v'] for x in self.baselines]
+                    # k leaves room for every baseline to sit above the
+                    # true maximum, so this walk stays inside ordering
+                    blines = {x['v'] for x in self.baselines}
                     n = -1
                     while the_spectrum.velocities[ordering[n]] in blines:
                         n -= 1
                 else:
                     n = -1
                 spec['max'] = vals[ordering[n]]
-                noise_floor = int(n - 0.1 * len(vals))
+                noise_floor = max(-k, int(n - 0.1 * len(vals)))
                 spec['90'] = vals[ordering[noise_floor]]
             else:
                 t_index = self.spectrogram._time_to_index(the_time)
@@ -933,11 +1259,13 @@ class SpectrogramWidget:
             # We need to worry about the format of the spectrum
             db = ('dB' in form)
             field = 'db' if db else 'power'
+            old_xlim = self.axSpectrum.get_xlim()
             the_line = self.axSpectrum.plot(
                 getattr(the_spectrum, field),
                 the_spectrum.velocities,
                 _colors[len(self.spectra)],
-                alpha=0.33
+                alpha=0.33,
+                animated=self.blitting
             )
             spec['line'] = the_line[0]
 
@@ -946,7 +1274,8 @@ class SpectrogramWidget:
                 [tval, tval],
                 [0, self.spectrogram.v_max],
                 _colors[len(self.spectra)],
-                alpha=0.33)
+                alpha=0.33,
+                animated=self.blitting)
             spec['marker'] = marker[0]
 
             self.spectra.append(spec)
@@ -966,6 +1295,12 @@ class SpectrogramWidget:
                 ninety = max([x['90'] for x in self.spectra])
                 peak = max([x['max'] for x in self.spectra])
                 self.axSpectrum.set_xlim(ninety, peak)
+            # If the power axis moved we need a full redraw; otherwise
+            # it is enough to blit the new line and marker
+            if self.axSpectrum.get_xlim() != old_xlim:
+                self.fig.canvas.draw_idle()
+            else:
+                self._blit()
             return 0
             line = self.axSpectrum.lines[0]
             intensities = the_spectrum.db